@@ -0,0 +1,146 @@
+"""Helpers shared by the terminal and Streamlit NYC chatbots."""
+from __future__ import annotations
+
+import os
+import time
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+
+import httpx
+import tiktoken
+
+# Chat model for both front-ends. Any OpenAI-compatible endpoint works: set
+# OPENAI_BASE_URL (e.g. https://api.groq.com/openai/v1) and OPENAI_API_KEY
+# to that provider's values and point NYC_MODEL at one of its models.
+MODEL = os.getenv("NYC_MODEL", "gpt-4o-mini")
+
+# Hard cap on reply length (~220 words) so worst-case latency and spend per
+# turn stay bounded; the persona is meant to be brief anyway
+MAX_REPLY_TOKENS = 300
+
+# Stop if the model starts writing the user's next line for them
+STOP_SEQUENCES = ["\nYou:"]
+
+
+# Connection-level retries (DNS/connect failures); the OpenAI SDK retries
+# failed requests on top of this
+TRANSPORT_RETRIES = 2
+
+# A chat session is a few long-lived streams, not a burst of short requests:
+# keep a small pool and hold idle connections for minutes so each turn skips
+# the TCP/TLS handshake
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300.0)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Context window sizes (tokens) for the models we talk to
+MODEL_CONTEXT_LIMITS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+}
+DEFAULT_CONTEXT_LIMIT = 120_000
+
+# Fraction of the window held back for the reply and tokenizer drift
+SAFETY_MARGIN = 0.10
+
+# Chat-format framing added around every message
+TOKENS_PER_MESSAGE = 4
+
+
+# Seconds to wait before retrying a tokenizer that failed to load
+ENCODING_RETRY_AFTER = 60.0
+
+_encodings: dict[str, tiktoken.Encoding] = {}
+_encoding_failed_at: dict[str, float] = {}
+
+
+def _load_encoding(model: str) -> tiktoken.Encoding | None:
+    """Return the tokenizer for ``model``, or None if it cannot be loaded now.
+
+    Loaded on first use, not at import: tiktoken downloads its BPE files the
+    first time, and an unreachable host must not break the front-ends. A
+    failure is retried after ENCODING_RETRY_AFTER seconds rather than kept
+    for the life of the process.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    failed_at = _encoding_failed_at.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_AFTER:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except (OSError, ValueError):
+        # Download failures (requests errors are OSErrors) or a corrupt file
+        _encoding_failed_at[model] = time.monotonic()
+        return None
+    _encoding_failed_at.pop(model, None)
+    _encodings[model] = encoding
+    return encoding
+
+
+@lru_cache(maxsize=4096)
+def _encoded_length(encoding_name: str, text: str) -> int:
+    return len(tiktoken.get_encoding(encoding_name).encode(text))
+
+
+def count_tokens(text: str, model: str = MODEL) -> int:
+    """Return the number of tokens ``model`` sees in ``text``.
+
+    Exact counts are memoised per string; without a tokenizer this falls back
+    to a ~4 characters per token estimate.
+    """
+    encoding = _load_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return _encoded_length(encoding.name, text)
+
+
+def message_tokens(message: Mapping[str, str], model: str = MODEL) -> int:
+    """Approximate prompt tokens consumed by a single chat message."""
+    return count_tokens(message["content"], model) + TOKENS_PER_MESSAGE
+
+
+def trim_messages(
+    messages: Sequence[Mapping[str, str]],
+    model: str = MODEL,
+    max_tokens: int | None = None,
+) -> list[Mapping[str, str]]:
+    """Return ``messages`` trimmed to fit the model's context budget.
+
+    The system prompt, the first user message and the newest message are
+    always kept. Older turns are dropped oldest-first, assistant reply before
+    the user message that follows it, until the history fits.
+    """
+    limit = max_tokens or MODEL_CONTEXT_LIMITS.get(model, DEFAULT_CONTEXT_LIMIT)
+    budget = int(limit * (1 - SAFETY_MARGIN))
+
+    trimmed = list(messages)
+    total = sum(message_tokens(m, model) for m in trimmed)
+    while total > budget and len(trimmed) > 3:
+        total -= message_tokens(trimmed.pop(2), model)
+        if len(trimmed) > 3 and trimmed[2]["role"] == "user":
+            total -= message_tokens(trimmed.pop(2), model)
+    return trimmed
+
+
+def build_http_client() -> httpx.Client:
+    """Return a keep-alive HTTP/2 httpx client for the OpenAI SDK.
+
+    HTTP/2 multiplexes concurrent calls (chat stream, cache embeddings) over
+    one connection instead of opening a dedicated HTTP/1.1 socket for each.
+    """
+    transport = httpx.HTTPTransport(
+        http2=True, limits=HTTP_LIMITS, retries=TRANSPORT_RETRIES
+    )
+    return httpx.Client(transport=transport, timeout=HTTP_TIMEOUT)
+
+
+def build_async_http_client() -> httpx.AsyncClient:
+    """Async counterpart of :func:`build_http_client` for ``AsyncOpenAI``."""
+    transport = httpx.AsyncHTTPTransport(
+        http2=True, limits=HTTP_LIMITS, retries=TRANSPORT_RETRIES
+    )
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
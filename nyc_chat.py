@@ -9,31 +9,45 @@ Commands inside chat:
   /reset             – reset conversation history
 
 Relies on an OpenAI API key loaded from environment or a `.env` file.
+Set NYC_MODEL to override the default model (gpt-4o-mini).
 """
 from __future__ import annotations
 
+import asyncio
 import os
 import sys
+import textwrap
+from collections import deque
+from typing import Final
 
+import numpy as np
 import openai
 from dotenv import load_dotenv
-from openai import OpenAI
-
-
-def initialize_openai() -> OpenAI:
-    """Load env vars and return an OpenAI client instance (SDK ≥1.0)."""
-    load_dotenv()
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print("[error] OPENAI_API_KEY is not set. Put it in a .env file or export it.")
-        sys.exit(1)
-    return OpenAI(api_key=api_key)
-
-
-def main() -> None:
-    client = initialize_openai()
-
-    system_prompt = """
+from openai import AsyncOpenAI
+
+from chat_utils import (
+    MAX_REPLY_TOKENS,
+    MODEL,
+    STOP_SEQUENCES,
+    build_async_http_client,
+    trim_messages,
+)
+from semantic_cache import (
+    EMBEDDING_MODEL,
+    LOOKUP_TIMEOUT,
+    SemanticCache,
+    to_unit_matrix,
+)
+
+
+# Sent byte-identical as the first message of every request so OpenAI's
+# automatic prompt caching can reuse the prefilled prefix across turns.
+# Keep per-turn data out of it; anything dynamic belongs in later messages.
+# It must stay above the 1024-token caching minimum on its own: the history
+# window slides every turn once full, so the persona is the only prefix that
+# consecutive requests are guaranteed to share. Currently 1107 tokens with
+# tiktoken's o200k_base (the gpt-4o / gpt-4o-mini encoding).
+SYSTEM_PROMPT: Final[str] = textwrap.dedent("""
         You are "NYC Bot," a chatbot embodying the spirit of a quintessential, street-smart New Yorker. Your primary goal is to answer questions and engage in conversation as if you've lived in one of the five boroughs your entire life. Authenticity is key.
 
 **Core Persona & Tone:**
@@ -83,11 +97,54 @@ def main() -> None:
 *   "Look, it's simple..."
 *   "Trust me on this one."
 
+**Quick Recap (restates the rules above; nothing new):**
+
+*   Direct and blunt; short, efficient answers.
+*   Sarcastic and witty, never mean.
+*   Street-smart, practical NYC advice over tourist-brochure answers.
+*   Loves the city, complains about it freely.
+*   Informal and conversational; contractions, sparing NYC slang, PG-13.
+*   Opinionated, especially about NYC.
+*   Never sound like a generic AI; admit what you don't know in a New Yorker way.
+*   Wrap up naturally, no formal goodbyes.
+
 Remember, you're not trying to be a rude caricature, but a believable, slightly jaded, but ultimately helpful New Yorker. It's a balancing act. Good luck, and don't mess it up!"
-    """
+    """).strip()
+
+# Shared, never-mutated persona message reused for every conversation reset
+SYSTEM_MESSAGE: Final[dict[str, str]] = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Past turns kept between requests (user/assistant pairs, system excluded)
+HISTORY_MAXLEN: Final[int] = 18
+
+EXIT_CMDS: Final[frozenset[str]] = frozenset({"/exit", "/quit", "/q"})
+
+
+def initialize_openai() -> AsyncOpenAI:
+    """Load env vars and return an async OpenAI client instance (SDK ≥1.0)."""
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("[error] OPENAI_API_KEY is not set. Put it in a .env file or export it.")
+        sys.exit(1)
+    return AsyncOpenAI(api_key=api_key, http_client=build_async_http_client())
+
+
+async def embed_text(client: AsyncOpenAI, text: str) -> np.ndarray | None:
+    """Return a unit-length embedding of ``text``, or None if the call fails."""
+    try:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    except openai.OpenAIError:
+        return None
+    return to_unit_matrix([response.data[0].embedding])[0]
 
-    # Conversation state: always start with system persona instruction
-    messages: list[dict[str, str]] = [{"role": "system", "content": system_prompt}]
+
+async def chat(client: AsyncOpenAI) -> None:
+    """Run the read-reply loop until the user leaves."""
+    # Conversation state: a ring buffer of past turns. The system persona
+    # lives outside it so it can never be evicted.
+    history: deque[dict[str, str]] = deque(maxlen=HISTORY_MAXLEN)
+    cache = SemanticCache(threshold=0.85)
 
     print("NYC Chatbot (type /exit to quit, /reset to start over)\n")
 
@@ -100,36 +157,84 @@ Remember, you're not trying to be a rude caricature, but a believable, slightly
 
         if not user_input:
             continue
-        if user_input.lower() in {"/exit", "/quit", "/q"}:
-            print("Catch ya later! 🗽")
-            break
-        if user_input.lower().startswith("/reset"):
-            messages = [{"role": "system", "content": system_prompt}]
-            print("Conversation reset. Shoot.")
-            continue
-
-        # Add user message and call the model
-        messages.append({"role": "user", "content": user_input})
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.9,
-            )
-        except openai.OpenAIError as exc:
-            print(f"[OpenAI error] {exc}")
-            # Remove last user message to keep state consistent
-            messages.pop()
-            continue
-
-        assistant_reply = response.choices[0].message.content.strip()
-        print(f"Bot: {assistant_reply}")
-        messages.append({"role": "assistant", "content": assistant_reply})
-
-        # Prevent runaway context size: keep system + last 18 messages
-        if len(messages) > 20:
-            messages = [messages[0]] + messages[-18:]
+        # Only slash-prefixed input can be a command; skip lower() otherwise
+        if user_input.startswith("/"):
+            command = user_input.lower()
+            if command in EXIT_CMDS:
+                print("Catch ya later! 🗽")
+                break
+            if command.startswith("/reset"):
+                history.clear()
+                print("Conversation reset. Shoot.")
+                continue
+
+        user_message = {"role": "user", "content": user_input}
+        # Persona first, then past turns and the new message, fitted to the
+        # token budget
+        messages = trim_messages([SYSTEM_MESSAGE, *history, user_message])
+
+        # Opening questions go through the semantic cache; follow-ups depend
+        # on earlier turns, so their replies are neither looked up nor stored.
+        # With entries to match, the embedding gets LOOKUP_TIMEOUT to come
+        # back; after that (or straight away on an empty cache) the completion
+        # starts and the embedding is only used to store the reply. The cache
+        # is best-effort, so an embedding failure counts as a miss.
+        embedding: asyncio.Task[np.ndarray | None] | None = None
+        cached_reply = None
+        if not history:
+            embedding = asyncio.create_task(embed_text(client, user_input))
+            if cache:
+                await asyncio.wait({embedding}, timeout=LOOKUP_TIMEOUT)
+            if embedding.done() and (query_vec := embedding.result()) is not None:
+                cached_reply = cache.get(query_vec)[0]
+
+        if cached_reply is not None:
+            print(f"Bot: {cached_reply}")
+            assistant_reply = cached_reply
+        else:
+            # Stream tokens to the terminal as they arrive
+            sys.stdout.write("Bot: ")
+            sys.stdout.flush()
+            chunks: list[str] = []
+            try:
+                response = await client.chat.completions.create(
+                    model=MODEL,
+                    messages=messages,
+                    temperature=0.9,
+                    max_tokens=MAX_REPLY_TOKENS,
+                    stop=STOP_SEQUENCES,
+                    stream=True,
+                )
+                # Hot per-token loop: bind the bound methods once
+                write, flush, append = sys.stdout.write, sys.stdout.flush, chunks.append
+                async for chunk in response:
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        write(token)
+                        flush()
+                        append(token)
+            except openai.OpenAIError as exc:
+                # History is untouched until a reply arrives, so just move on
+                print(f"\n[OpenAI error] {exc}")
+                if embedding is not None:
+                    embedding.cancel()
+                continue
+            print()
+
+            assistant_reply = "".join(chunks).strip()
+            if embedding is not None and (query_vec := await embedding) is not None:
+                cache.set(query_vec, assistant_reply)
+
+        # Record the turn as a pair so evictions never split question/answer
+        history.append(user_message)
+        history.append({"role": "assistant", "content": assistant_reply})
+
+
+async def main() -> None:
+    # Closing the client shuts its HTTP/2 connection pool down cleanly
+    async with initialize_openai() as client:
+        await chat(client)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -6,31 +6,79 @@ Run with:
 from __future__ import annotations
 
 import os
-
+import sys
+import time
+from collections import Counter, deque
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Final
+
+import numpy as np
+import openai
 import streamlit as st
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from chat_utils import (
+    MAX_REPLY_TOKENS,
+    MODEL,
+    STOP_SEQUENCES,
+    build_http_client,
+    trim_messages,
+)
+from semantic_cache import (
+    EMBEDDING_MODEL,
+    LOOKUP_TIMEOUT,
+    SemanticCache,
+    to_unit_matrix,
+)
+
 # -----------------------------------------------------------------------------
 # Initialisation helpers
 # -----------------------------------------------------------------------------
 
-def init_openai() -> OpenAI:
-    """Return an OpenAI client, loading the API key from env/.env."""
-    load_dotenv()
+def get_api_key() -> str | None:
+    """Return the OpenAI API key from env/.env, if any.
+
+    The .env file is only read while no key is set, so once a key is found
+    reruns skip the filesystem walk, but a key added later is still picked up.
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
-        st.error("OPENAI_API_KEY not set. Add it to a .env file.")
-        st.stop()
-    return OpenAI(api_key=api_key)
+        load_dotenv()
+        api_key = os.getenv("OPENAI_API_KEY")
+    return api_key
 
 
-def get_persona_prompt() -> str:
-    """System prompt defining the New Yorker persona."""
-    return (
-        "You are a true native New Yorker: fast-talking, slightly sarcastic, uses phrases like "
-        "\"fuhgeddaboudit\" and \"I’m walkin’ here!\" Keep answers short, witty, and direct."
-    )
+@st.cache_resource
+def init_openai(api_key: str) -> OpenAI:
+    """Return a process-wide OpenAI client for ``api_key``.
+
+    Cached so reruns reuse one client (and its warm connection pool).
+    """
+    return OpenAI(api_key=api_key, http_client=build_http_client())
+
+
+@st.cache_resource
+def get_embed_pool() -> ThreadPoolExecutor:
+    """Return the worker pool that runs cache embeddings off the script thread."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed")
+
+
+# System prompt defining the New Yorker persona. Interned so every system
+# message built from it shares one string object.
+PERSONA_PROMPT: Final[str] = sys.intern(
+    "You are a true native New Yorker: fast-talking, slightly sarcastic, uses phrases like "
+    "\"fuhgeddaboudit\" and \"I’m walkin’ here!\" Keep answers short, witty, and direct."
+)
+
+
+# Prepended to every request; kept out of the session history so it can
+# never be evicted
+SYSTEM_MESSAGE: Final[dict[str, str]] = {"role": "system", "content": PERSONA_PROMPT}
+
+# Past turns kept per session (user/assistant pairs, system excluded)
+HISTORY_MAXLEN: Final[int] = 38
 
 
 # -----------------------------------------------------------------------------
@@ -80,6 +128,9 @@ QUESTIONS = [
     },
 ]
 
+# Per-question option text -> borough, for O(1) scoring lookups
+ANSWER_TO_BOROUGH = [dict(q["options"]) for q in QUESTIONS]
+
 BOROUGH_DESCRIPTIONS = {
     "Manhattan": "You're always on the move and know where the action is. Ambitious, polished, and unfazed by the hustle.",
     "Brooklyn": "You've got an artistic soul and a love for authenticity—from pour-over coffee to underground shows.",
@@ -89,6 +140,44 @@ BOROUGH_DESCRIPTIONS = {
 }
 
 
+@st.cache_data
+def score_answers(answers: tuple[str, ...]) -> str:
+    """Return the borough matching the most answers.
+
+    Ties go to the borough listed first in BOROUGH_DESCRIPTIONS, regardless
+    of the order the answers were given in.
+    """
+    scores = Counter(ANSWER_TO_BOROUGH[qi][answer] for qi, answer in enumerate(answers))
+    return max(BOROUGH_DESCRIPTIONS, key=scores.__getitem__)
+
+
+@st.cache_resource
+def option_vectors(_client: OpenAI) -> list[np.ndarray]:
+    """Return each question's option embeddings, fetched in one batched call.
+
+    One L2-normalised float32 matrix per question, rows in option order, so
+    matching a free-text answer is a single mat-vec. Cached for the process.
+    """
+    texts = [text for q in QUESTIONS for text, _ in q["options"]]
+    response = _client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    rows = sorted(response.data, key=lambda d: d.index)
+    matrix = to_unit_matrix([d.embedding for d in rows])
+    bounds = np.cumsum([len(q["options"]) for q in QUESTIONS])[:-1]
+    return np.split(matrix, bounds)
+
+
+def match_free_text(client: OpenAI, q_idx: int, text: str) -> str | None:
+    """Return the option of question ``q_idx`` closest to ``text``, or None on API failure."""
+    user_vec = embed_text(client, text)
+    if user_vec is None:
+        return None
+    try:
+        vectors = option_vectors(client)[q_idx]
+    except openai.OpenAIError:
+        return None
+    return QUESTIONS[q_idx]["options"][int(np.argmax(vectors @ user_vec))][0]
+
+
 def reset_quiz_state() -> None:
     """Reset all session_state variables related to the quiz."""
     st.session_state.quiz_started = False
@@ -97,16 +186,56 @@ def reset_quiz_state() -> None:
     st.session_state.quiz_result = None
 
 
-def run_quiz() -> None:
-    """Render the quiz UI and handle its state transitions."""
+# Button callbacks run before the script re-executes, so the state they set
+# is already in place for the next pass and no explicit st.rerun() is needed.
+
+def _start_quiz() -> None:
+    st.session_state.quiz_started = True
+
+
+def _back_to_chat() -> None:
+    st.session_state.mode = "Chat Mode"
+    reset_quiz_state()
+
+
+def _prev_question() -> None:
+    if st.session_state.quiz_index > 0:
+        st.session_state.quiz_index -= 1
+
+
+def _next_question(client: OpenAI) -> None:
+    q_idx = st.session_state.quiz_index
+    choice = st.session_state.get(f"quiz_q{q_idx}")
+    # A free-text answer overrides the radio when it can be matched; the
+    # radio is moved to the match so going back shows how it was read
+    free_text = st.session_state.get(f"quiz_free{q_idx}", "").strip()
+    if free_text and (matched := match_free_text(client, q_idx, free_text)):
+        choice = st.session_state[f"quiz_q{q_idx}"] = matched
+    if not choice:
+        return
+
+    # Save/update answer
+    answers = st.session_state.quiz_answers
+    if len(answers) > q_idx:
+        answers[q_idx] = choice
+    else:
+        answers.append(choice)
+
+    if q_idx + 1 < len(QUESTIONS):
+        st.session_state.quiz_index += 1
+    else:
+        st.session_state.quiz_result = score_answers(tuple(answers))
+
+
+def run_quiz(client: OpenAI) -> None:
+    """Render the quiz UI; state transitions happen in the button callbacks."""
     if "quiz_started" not in st.session_state:
         reset_quiz_state()
 
     if not st.session_state.quiz_started:
         st.subheader("What Kind of New Yorker Are YOU?")
         st.write("Answer a few quick questions to discover your NYC borough persona!")
-        if st.button("Start Quiz", key="start_quiz"):
-            st.session_state.quiz_started = True
+        st.button("Start Quiz", key="start_quiz", on_click=_start_quiz)
         return
 
     # If result already exists, show it
@@ -116,14 +245,9 @@ def run_quiz() -> None:
         st.write(BOROUGH_DESCRIPTIONS[borough])
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("Chat with NYC Bot", key="back_to_chat"):
-                st.session_state.mode = "Chat Mode"
-                reset_quiz_state()
-                st.rerun()
+            st.button("Chat with NYC Bot", key="back_to_chat", on_click=_back_to_chat)
         with col2:
-            if st.button("Retake Quiz", key="retake_quiz"):
-                reset_quiz_state()
-                st.rerun()
+            st.button("Retake Quiz", key="retake_quiz", on_click=reset_quiz_state)
         return
 
     # Show current question
@@ -133,145 +257,134 @@ def run_quiz() -> None:
     st.write(question["text"])
 
     option_texts = [opt[0] for opt in question["options"]]
-    choice = st.radio("", option_texts, key=f"quiz_q{q_idx}")
+    st.radio("", option_texts, key=f"quiz_q{q_idx}")
+    st.text_input("...or say it in your own words", key=f"quiz_free{q_idx}")
 
     cols = st.columns(2)
     with cols[0]:
-        if st.button("Previous", key="prev_q") and q_idx > 0:
-            st.session_state.quiz_index -= 1
-            st.rerun()
+        st.button("Previous", key="prev_q", on_click=_prev_question)
     with cols[1]:
-        if st.button("Next", key="next_q"):
-            if choice:
-                # Save/update answer
-                if len(st.session_state.quiz_answers) > q_idx:
-                    st.session_state.quiz_answers[q_idx] = choice
-                else:
-                    st.session_state.quiz_answers.append(choice)
-
-                if q_idx + 1 < len(QUESTIONS):
-                    st.session_state.quiz_index += 1
-                    st.rerun()
-                else:
-                    # Compute result
-                    scores = {b: 0 for b in BOROUGH_DESCRIPTIONS}
-                    for qi, answer_text in enumerate(st.session_state.quiz_answers):
-                        borough = next(b for text, b in QUESTIONS[qi]["options"] if text == answer_text)
-                        scores[borough] += 1
-                    st.session_state.quiz_result = max(scores, key=scores.get)
-                    st.rerun()
+        st.button("Next", key="next_q", on_click=_next_question, args=(client,))
 
 # -----------------------------------------------------------------------------
 # Chat logic
 # -----------------------------------------------------------------------------
 
+# Minimum seconds between markdown repaints while a reply is streaming
+RENDER_INTERVAL = 0.04
+
+
+def embed_text(client: OpenAI, text: str) -> np.ndarray | None:
+    """Return a unit-length embedding of ``text``, or None if the call fails."""
+    try:
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    except openai.OpenAIError:
+        return None
+    return to_unit_matrix([response.data[0].embedding])[0]
+
+
 def stream_llm_response(client: OpenAI, messages: list[dict[str, str]]):
     """Yield content tokens from the streaming Chat Completions API."""
     response = client.chat.completions.create(
-        model="gpt-4o",  # use 3.5-turbo if 4o not available
+        model=MODEL,
         messages=messages,
         temperature=0.9,
+        max_tokens=MAX_REPLY_TOKENS,
+        stop=STOP_SEQUENCES,
         stream=True,
     )
+    # Hot per-token loop: read each delta's content once
     for chunk in response:
-        delta = chunk.choices[0].delta
-        if delta.content:
-            yield delta.content
+        content = chunk.choices[0].delta.content
+        if content:
+            yield content
 
 
 # -----------------------------------------------------------------------------
 # Streamlit page
 # -----------------------------------------------------------------------------
 
-def main() -> None:
-    st.set_page_config(page_title="NYC Chatbot", page_icon="🗽")
-    st.title("🗽 New Yorker Chatbot")
-    st.caption("Talk like you're on 7th Ave. Powered by OpenAI.")
-
-    if "messages" not in st.session_state:
-        st.session_state.messages = [
-            {"role": "system", "content": get_persona_prompt()},
-        ]
+def _render_history(messages: Iterable[dict[str, str]]) -> None:
+    """Paint past chat turns.
 
-    client = init_openai()
-
-    # Display conversation history (skip system message)
-    for msg in st.session_state.messages[1:]:
-        avatar = "user" if msg["role"] == "user" else "assistant"
-        with st.chat_message(avatar):
+    Streamlit drops every element a rerun does not re-emit, so the history
+    has to be repainted each pass; the frontend diffs unchanged messages.
+    """
+    for msg in messages:
+        with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
 
-    # Chat input box
-    if prompt := st.chat_input("Say something..."):
-        # Show user message immediately
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        # Assistant streamed answer
-        with st.chat_message("assistant"):
-            stream_container = st.empty()
-            answer_accum = ""
-            for token in stream_llm_response(client, st.session_state.messages):
-                answer_accum += token
-                stream_container.markdown(answer_accum)
-            st.session_state.messages.append({"role": "assistant", "content": answer_accum})
-
-        # Trim history if too long
-        if len(st.session_state.messages) > 40:
-            st.session_state.messages = [st.session_state.messages[0]] + st.session_state.messages[-38:]
-
-    # Sidebar controls
-    with st.sidebar:
-        st.header("⚙️ Options")
-        if st.button("Reset conversation"):
-            st.session_state.messages = [
-                {"role": "system", "content": get_persona_prompt()},
-            ]
-            st.rerun()
-        st.markdown("—")
-        st.markdown("Made with ❤️ in NYC & Streamlit")
-
-# -----------------------------------------------------------------------------
-# Quiz-enabled main (overrides earlier definition)
-# -----------------------------------------------------------------------------
 
-def _run_chat() -> None:
-    """Original chat interface extracted for reuse."""
-    client = init_openai()
-
-    # Display conversation history (skip system message)
-    for msg in st.session_state.messages[1:]:
-        avatar = "user" if msg["role"] == "user" else "assistant"
-        with st.chat_message(avatar):
-            st.markdown(msg["content"])
+def _run_chat(client: OpenAI) -> None:
+    """Render the chat history and handle a new chat turn."""
+    history: deque[dict[str, str]] = st.session_state.history
+    _render_history(history)
 
     if prompt := st.chat_input("Say something..."):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        # Per-session semantic cache for opening questions; follow-ups depend
+        # on earlier turns, so their replies are neither looked up nor stored.
+        # The embedding runs on a worker thread and gets LOOKUP_TIMEOUT to
+        # come back; after that (or straight away on an empty cache) the
+        # completion starts and the embedding is only used to store the reply.
+        cache: SemanticCache = st.session_state.cache
+        embedding: Future[np.ndarray | None] | None = None
+        cached_reply = None
+        if not history:
+            embedding = get_embed_pool().submit(embed_text, client, prompt)
+            if cache:
+                wait([embedding], timeout=LOOKUP_TIMEOUT)
+            if embedding.done() and (query_vec := embedding.result()) is not None:
+                cached_reply = cache.get(query_vec)[0]
+
+        user_message = {"role": "user", "content": prompt}
         with st.chat_message("user"):
             st.markdown(prompt)
         with st.chat_message("assistant"):
-            stream_container = st.empty()
-            answer_accum = ""
-            for token in stream_llm_response(client, st.session_state.messages):
-                answer_accum += token
-                stream_container.markdown(answer_accum)
-            st.session_state.messages.append({"role": "assistant", "content": answer_accum})
-
-        # Trim history
-        if len(st.session_state.messages) > 40:
-            st.session_state.messages = [st.session_state.messages[0]] + st.session_state.messages[-38:]
+            if cached_reply is not None:
+                answer_accum = cached_reply
+                st.markdown(answer_accum)
+            else:
+                # Repaint at most every RENDER_INTERVAL: each markdown() call
+                # re-renders the whole reply, so per-token repaints are O(n^2)
+                render = st.empty().markdown
+                monotonic = time.monotonic
+                answer_accum = ""
+                last_render = monotonic()
+                messages = trim_messages([SYSTEM_MESSAGE, *history, user_message])
+                for token in stream_llm_response(client, messages):
+                    answer_accum += token
+                    now = monotonic()
+                    if now - last_render >= RENDER_INTERVAL:
+                        render(answer_accum)
+                        last_render = now
+                render(answer_accum)
+                if embedding is not None and (query_vec := embedding.result()) is not None:
+                    cache.set(query_vec, answer_accum)
+        # Record the turn as a pair so evictions never split question/answer
+        history.append(user_message)
+        history.append({"role": "assistant", "content": answer_accum})
 
 
 def main() -> None:
     """Entry point with Chat vs Quiz toggle."""
     st.set_page_config(page_title="NYC Chatbot", page_icon="🗽")
+
+    # Fail fast, before any session state or rendering work. (Streamlit
+    # requires set_page_config to be the first st call, so it stays above.)
+    api_key = get_api_key()
+    if not api_key:
+        st.error("OPENAI_API_KEY not set. Add it to a .env file.")
+        st.stop()
+    client = init_openai(api_key)
+
     st.title("🗽 New Yorker Chatbot")
     st.caption("Talk like you're on 7th Ave. Powered by OpenAI.")
 
     # Session defaults
-    if "messages" not in st.session_state:
-        st.session_state.messages = [{"role": "system", "content": get_persona_prompt()}]
+    if "history" not in st.session_state:
+        st.session_state.history = deque(maxlen=HISTORY_MAXLEN)
+    if "cache" not in st.session_state:
+        st.session_state.cache = SemanticCache(threshold=0.85)
     if "mode" not in st.session_state:
         st.session_state.mode = "Chat Mode"
 
@@ -283,20 +396,21 @@ def main() -> None:
             ("Chat Mode", "NYC Persona Quiz"),
             index=0 if st.session_state.mode == "Chat Mode" else 1,
         )
+        # The chat is rendered after the sidebar, so a reset here already
+        # shows up in this pass without forcing a rerun
         if (
             st.session_state.mode == "Chat Mode"
             and st.button("Reset conversation")
         ):
-            st.session_state.messages = [{"role": "system", "content": get_persona_prompt()}]
-            st.rerun()
+            st.session_state.history.clear()
         st.markdown("—")
         st.markdown("Made with ❤️ in NYC & Streamlit")
 
     # Route
     if st.session_state.mode == "Chat Mode":
-        _run_chat()
+        _run_chat(client)
     else:
-        run_quiz()
+        run_quiz(client)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""In-memory semantic response cache for the NYC chatbot front-ends.
+
+Each conversation owns one cache. Replies are keyed by the embedding of the
+user's message, so paraphrased repeats ("best pizza?" vs "where's good
+pizza") are answered without another chat completion. Only opening questions
+are looked up: a follow-up like "tell me more" depends on the turns before
+it and would otherwise match the previous question and repeat its answer.
+Callers own the API client and pass in vectors; this module never talks to
+the network.
+"""
+from __future__ import annotations
+
+import threading
+from collections.abc import Sequence
+
+import numpy as np
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Seconds to wait for the lookup embedding before giving up on the cache for
+# this turn and starting the chat completion
+LOOKUP_TIMEOUT = 0.3
+
+
+def to_unit_matrix(embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+    """Stack embeddings into a float32 matrix with L2-normalised rows."""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return matrix / norms
+
+
+class SemanticCache:
+    """Nearest-neighbour lookup of past replies by cosine similarity.
+
+    The store is guarded by a lock so an embedding finished on a worker
+    thread can be stored while the caller reads.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        max_entries: int = 256,
+    ) -> None:
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors: np.ndarray | None = None
+        self._replies: list[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._replies)
+
+    def get(self, vector: np.ndarray) -> tuple[str | None, float]:
+        """Return ``(reply, similarity)`` for the closest entry, or ``(None, best)``."""
+        with self._lock:
+            if self._vectors is None:
+                return None, 0.0
+            sims = self._vectors @ vector.reshape(-1)
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            if similarity >= self.threshold:
+                return self._replies[best], similarity
+            return None, similarity
+
+    def set(self, vector: np.ndarray, reply: str) -> None:
+        """Store ``reply`` under ``vector``, evicting the oldest entry when full."""
+        row = vector.reshape(1, -1)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = row
+            else:
+                self._vectors = np.vstack((self._vectors, row))[-self.max_entries:]
+            self._replies.append(reply)
+            del self._replies[:-self.max_entries]
@@ -0,0 +1,69 @@
+import pytest
+
+import chat_utils
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """Count one token per word so budgets are predictable offline."""
+    seen_models = []
+
+    def count(text, model=chat_utils.MODEL):
+        seen_models.append(model)
+        return len(text.split())
+
+    monkeypatch.setattr(chat_utils, "count_tokens", count)
+    monkeypatch.setattr(chat_utils, "TOKENS_PER_MESSAGE", 0)
+    monkeypatch.setattr(chat_utils, "SAFETY_MARGIN", 0.0)
+    return seen_models
+
+
+def msg(role, words):
+    return {"role": role, "content": " ".join([role[0]] * words)}
+
+
+def test_trim_keeps_history_within_budget_untouched():
+    messages = [msg("system", 2), msg("user", 2), msg("assistant", 2), msg("user", 2)]
+    assert chat_utils.trim_messages(messages, max_tokens=100) == messages
+
+
+def test_trim_drops_assistant_then_user_and_keeps_first_user():
+    system, first = msg("system", 5), msg("user", 1)
+    a1, u2, a2, u3 = msg("assistant", 10), msg("user", 10), msg("assistant", 3), msg("user", 1)
+    trimmed = chat_utils.trim_messages([system, first, a1, u2, a2, u3], max_tokens=12)
+    assert trimmed == [system, first, a2, u3]
+
+
+def test_trim_never_drops_system_first_user_or_newest():
+    messages = [msg("system", 50), msg("user", 50), msg("assistant", 50), msg("user", 50)]
+    trimmed = chat_utils.trim_messages(messages, max_tokens=10)
+    assert trimmed == [messages[0], messages[1], messages[3]]
+
+
+def test_trim_counts_tokens_for_the_given_model(word_tokens):
+    chat_utils.trim_messages([msg("system", 1), msg("user", 1)], model="gpt-4o", max_tokens=10)
+    assert set(word_tokens) == {"gpt-4o"}
+
+
+def test_encoding_failure_is_retried_later(monkeypatch):
+    monkeypatch.setattr(chat_utils, "_encodings", {})
+    monkeypatch.setattr(chat_utils, "_encoding_failed_at", {})
+    sentinel = object()
+    calls = []
+
+    def encoding_for_model(model):
+        calls.append(model)
+        if len(calls) == 1:
+            raise OSError("offline")
+        return sentinel
+
+    monkeypatch.setattr(chat_utils.tiktoken, "encoding_for_model", encoding_for_model)
+
+    assert chat_utils._load_encoding("gpt-4o") is None
+    assert chat_utils._load_encoding("gpt-4o") is None
+    assert len(calls) == 1
+
+    chat_utils._encoding_failed_at["gpt-4o"] -= chat_utils.ENCODING_RETRY_AFTER
+    assert chat_utils._load_encoding("gpt-4o") is sentinel
+    assert chat_utils._load_encoding("gpt-4o") is sentinel
+    assert len(calls) == 2
@@ -0,0 +1,47 @@
+import numpy as np
+
+from semantic_cache import SemanticCache, to_unit_matrix
+
+
+def unit(*values):
+    return to_unit_matrix([values])[0]
+
+
+def test_to_unit_matrix_normalises_rows():
+    matrix = to_unit_matrix([[3.0, 4.0], [0.0, 0.0]])
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(matrix, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_get_on_empty_cache_misses():
+    assert SemanticCache().get(unit(1.0, 0.0)) == (None, 0.0)
+
+
+def test_get_hits_only_at_or_above_threshold():
+    cache = SemanticCache(threshold=0.9)
+    cache.set(unit(1.0, 0.0), "pizza")
+
+    reply, similarity = cache.get(unit(1.0, 0.1))
+    assert reply == "pizza" and similarity >= 0.9
+
+    reply, similarity = cache.get(unit(1.0, 1.0))
+    assert reply is None and similarity < 0.9
+
+
+def test_set_evicts_oldest_entry_when_full():
+    cache = SemanticCache(threshold=0.99, max_entries=2)
+    cache.set(unit(1.0, 0.0, 0.0), "first")
+    cache.set(unit(0.0, 1.0, 0.0), "second")
+    cache.set(unit(0.0, 0.0, 1.0), "third")
+
+    assert cache.get(unit(1.0, 0.0, 0.0))[0] is None
+    assert cache.get(unit(0.0, 1.0, 0.0))[0] == "second"
+    assert cache.get(unit(0.0, 0.0, 1.0))[0] == "third"
+
+
+def test_len_counts_stored_replies():
+    cache = SemanticCache(max_entries=1)
+    assert not cache
+    cache.set(unit(1.0, 0.0), "a")
+    cache.set(unit(0.0, 1.0), "b")
+    assert len(cache) == 1